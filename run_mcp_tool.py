@@ -1,47 +1,253 @@
-import subprocess
+import asyncio
+import base64
 import json
-import time
+import os
+import subprocess
+import sys
+import tempfile
 
-def send_rpc_message(process, message):
-    message_str = json.dumps(message)
-    process.stdin.write((message_str + '\n').encode('utf-8'))
-    process.stdin.flush()
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows; pipes just keep their default size there
+    fcntl = None
 
-def read_rpc_response(process):
-    # This is a simplified reader. In a real scenario, you'd need to handle
-    # potentially incomplete lines and more robust JSON parsing.
-    # For now, we assume the server sends a complete JSON object per line.
-    while True:
-        line = process.stdout.readline().decode('utf-8').strip()
-        if line:
-            try:
-                return json.loads(line)
-            except json.JSONDecodeError:
-                # Not a JSON line, might be a log or error message
-                print(f"Non-JSON output: {line}")
-        else:
-            # No more output or process terminated
-            break
-    return None
+try:
+    import orjson
+except ImportError:
+    # Optional: faster (de)serialization of large row payloads; stdlib json otherwise
+    orjson = None
 
-def main():
-    server_path = "snowflake-mcp/server.py"
-    python_executable = "snowflake-mcp/.venv/bin/python"
+try:
+    import uvloop
+except ImportError:
+    # Optional: faster event loop; the stock asyncio loop is used otherwise
+    uvloop = None
+
+# Large tools/call responses (thousands of rows) fit in one pipe buffer at this
+# size, so the server never stalls mid-write waiting for us to drain it.
+PIPE_SIZE = 1 << 20
+
+# How much the stdout reader buffers before pausing the pipe.
+STREAM_LIMIT = 64 << 20
+
+# How long the server gets to answer initialize (interpreter start + imports).
+STARTUP_TIMEOUT = 30
+
+# How long protocol requests like tools/list may take; matches the tool
+# timeout in .gemini/settings.json.
+RESPONSE_TIMEOUT = 30
+
+# How long a tools/call may take. The first one opens the Snowflake
+# connection, which can mean an SSO browser login; the connector itself
+# waits up to 120s (external_browser_timeout) for that, so allow more.
+TOOL_CALL_TIMEOUT = 180
+
+def _default_socket_path():
+    """Per-user socket location: $XDG_RUNTIME_DIR if set, else a uid-suffixed temp file."""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "pm-mcp.sock")
+    suffix = f"-{os.getuid()}" if hasattr(os, "getuid") else ""
+    return os.path.join(tempfile.gettempdir(), f"pm-mcp{suffix}.sock")
+
+# Where a long-running server (server.py --listen PATH) accepts connections.
+# When it's there we skip spawning a fresh interpreter and re-importing
+# snowflake.connector on every run.
+SOCKET_PATH = os.environ.get("PM_MCP_SOCKET") or _default_socket_path()
+
+def _pipe_size():
+    """
+    Pipe capacity to request from the kernel, or -1 to keep the default.
+
+    Linux refuses F_SETPIPE_SZ above /proc/sys/fs/pipe-max-size for
+    unprivileged processes, so clamp to it. Other platforms have no such
+    file and keep their default pipe size. The kernel can still say no
+    (e.g. over pipe-user-pages-soft); _grow_pipes ignores that.
+    """
+    try:
+        with open("/proc/sys/fs/pipe-max-size") as f:
+            return min(PIPE_SIZE, int(f.read()))
+    except (OSError, ValueError):
+        return -1
+
+def _dumps(message):
+    if orjson is not None:
+        return orjson.dumps(message)
+    return json.dumps(message).encode('utf-8')
+
+def _loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _content_length(header):
+    for line in header.split(b'\r\n'):
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            return int(value)
+    raise ValueError(f"Missing Content-Length in header: {header!r}")
+
+async def send_rpc_message(writer, message):
+    # LSP-style framing: the server reads the body in one fixed-size read.
+    # Header and body go out together as a single pipe write.
+    body = _dumps(message)
+    writer.writelines([b'Content-Length: %d\r\n\r\n' % len(body), body])
+    await writer.drain()
+
+def tool_payload(response):
+    """
+    The dict a tool returned, parsed back out of its tools/call response.
+
+    Returns {} for a JSON-RPC error, a tool that raised (isError: its text
+    is a plain error message, not JSON) or a result with no content.
+    """
+    result = response.get("result") or {}
+    content = result.get("content") or []
+    if result.get("isError") or not content:
+        return {}
+    return _loads(content[0]["text"])
+
+def decode_arrow(payload):
+    """Rebuild the pyarrow.Table from a layout="arrow" tool result."""
+    # Imported here so runs that never ask for Arrow don't pay for loading pyarrow
+    import pyarrow.ipc
+
+    return pyarrow.ipc.open_stream(base64.b64decode(payload["arrow_b64"])).read_all()
 
-    print(f"Starting MCP server: {python_executable} {server_path}")
-    server_process = subprocess.Popen(
-        [python_executable, server_path],
+def _grow_pipes(process):
+    """
+    Best-effort F_SETPIPE_SZ on the server's stdin/stdout/stderr pipes.
+
+    Done after spawning rather than via Popen's pipesize, which uvloop's
+    subprocess_exec rejects and Python < 3.10 doesn't know. A bigger pipe is
+    only an optimization, so a refusal leaves the default size in place.
+    """
+    set_pipe_size = getattr(fcntl, "F_SETPIPE_SZ", None)
+    size = _pipe_size()
+    if set_pipe_size is None or size <= 0:
+        return
+    for n in (0, 1, 2):
+        # uvloop wires the child's stdio to socketpairs, not pipes, so there
+        # is no "pipe" here and nothing to resize
+        pipe = process._transport.get_pipe_transport(n).get_extra_info("pipe")
+        if pipe is None:
+            continue
+        try:
+            fcntl.fcntl(pipe.fileno(), set_pipe_size, size)
+        except OSError:
+            pass
+
+async def _spawn_server(*cmd):
+    """Start the server with its stdio on (enlarged) pipes."""
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        bufsize=0
+        limit=STREAM_LIMIT
     )
+    _grow_pipes(process)
+    return process
+
+async def _drain(stream, sink):
+    """Pass the server's stderr through as it arrives so its pipe never fills up."""
+    while True:
+        chunk = await stream.read(PIPE_SIZE)
+        if not chunk:
+            break
+        sink.write(chunk)
+        sink.flush()
+
+class RpcReader:
+    """
+    Reads Content-Length framed JSON-RPC messages off the server's output stream.
+
+    Responses are stashed by id; notifications (and server-initiated
+    requests) are kept aside so they never get mistaken for the response
+    we're waiting on.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.responses = {}
+        self.notifications = []
+
+    async def next_message(self):
+        """Return the next JSON message from the server, or None on EOF."""
+        try:
+            header = await self.stream.readuntil(b'\r\n\r\n')
+            body = await self.stream.readexactly(_content_length(header))
+        except asyncio.IncompleteReadError:
+            # Server closed the stream / terminated
+            return None
+        return _loads(body)
+
+    async def wait_for(self, message_id, timeout=RESPONSE_TIMEOUT):
+        """
+        Read until the response for message_id arrives.
+
+        Raises TimeoutError if it takes longer than timeout seconds and
+        RuntimeError if the server closes the stream (exits) before answering,
+        so a dead or wedged server never leaves us blocked on a read.
+        """
+        try:
+            return await asyncio.wait_for(self._read_until(message_id), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"No response to request {message_id!r} within {timeout}s") from None
+
+    async def _read_until(self, message_id):
+        while message_id not in self.responses:
+            message = await self.next_message()
+            if message is None:
+                raise RuntimeError(f"MCP server closed the connection before answering request {message_id!r}")
+            if "method" in message:
+                self.notifications.append(message)
+            else:
+                self.responses[message.get("id")] = message
+        return self.responses.pop(message_id)
+
+async def _open_daemon(path):
+    """Connect to a running server's unix socket; None if there isn't a usable one."""
+    if not hasattr(asyncio, "open_unix_connection"):
+        return None
+    try:
+        # Only talk to a server this user started: whoever owns the socket
+        # sees our requests and decides what comes back
+        if os.stat(path).st_uid != os.getuid():
+            print(f"Ignoring {path}: not owned by this user")
+            return None
+        return await asyncio.open_unix_connection(path, limit=STREAM_LIMIT)
+    except OSError:
+        # No socket, a stale one left by a server that's gone, or one we can't
+        # open: any of these just means spawning our own server
+        return None
+
+async def main():
+    server_path = "snowflake-mcp/server.py"
+    python_executable = "snowflake-mcp/.venv/bin/python"
 
-    # Give the server a moment to start up
-    time.sleep(2)
+    server_process = None
+    stderr_task = None
+    connection = await _open_daemon(SOCKET_PATH)
+    if connection is not None:
+        print(f"Using running MCP server at {SOCKET_PATH}")
+        server_output, server_input = connection
+    else:
+        print(f"Starting MCP server: {python_executable} {server_path} --framing content-length")
+        server_process = await _spawn_server(
+            python_executable, server_path, "--framing", "content-length"
+        )
+        server_output, server_input = server_process.stdout, server_process.stdin
+        # snowflake.connector logs a lot (SSO, keep-alive); if nobody reads stderr
+        # the server eventually blocks on it and stops answering on stdout.
+        stderr_task = asyncio.create_task(_drain(server_process.stderr, sys.stderr.buffer))
+    reader = RpcReader(server_output)
 
     try:
         # 1. Send Initialize Request
+        # No startup sleep: the request waits in the pipe until the server
+        # gets around to reading it, and we only wait as long as it takes.
         init_message = {
             "jsonrpc": "2.0",
             "id": "1",
@@ -53,13 +259,13 @@ def main():
             }
         }
         print("Sending initialize message...")
-        send_rpc_message(server_process, init_message)
-        init_response = read_rpc_response(server_process)
+        await send_rpc_message(server_input, init_message)
+        init_response = await reader.wait_for("1", STARTUP_TIMEOUT)
         print(f"Initialize Response: {init_response}")
 
-        # After initialization, we should expect an 'initialized' notification from the server.
-        # However, the current read_rpc_response only reads one line.
-        # For simplicity, I'll proceed assuming initialize worked if the response wasn't an error.
+        # The handshake is only complete once the client confirms it; the server
+        # rejects other requests until it sees this notification.
+        await send_rpc_message(server_input, {"jsonrpc": "2.0", "method": "notifications/initialized"})
 
         # 2. Send Tools List Request (as a test to ensure communication works)
         list_tools_message = {
@@ -69,8 +275,8 @@ def main():
             "params": {}
         }
         print("\nSending tools/list message...")
-        send_rpc_message(server_process, list_tools_message)
-        list_tools_response = read_rpc_response(server_process)
+        await send_rpc_message(server_input, list_tools_message)
+        list_tools_response = await reader.wait_for("2")
         print(f"Tools List Response: {list_tools_response}")
 
         # Now, attempt to call run_saved_query for connector_usage
@@ -95,17 +301,45 @@ def main():
             }
         }
         print(f"\nSending run_saved_query for 'connector_usage' (Month: {current_month}, Year: {current_year})...")
-        send_rpc_message(server_process, run_query_message)
-        run_query_response = read_rpc_response(server_process)
+        await send_rpc_message(server_input, run_query_message)
+        run_query_response = await reader.wait_for("3", TOOL_CALL_TIMEOUT)
         print(f"Run Query Response: {run_query_response}")
 
+        # 4. Same data path, but the result comes back as an Arrow IPC stream
+        arrow_query_message = {
+            "jsonrpc": "2.0",
+            "id": "4",
+            "method": "tools/call",
+            "params": {
+                "name": "basic_query",
+                "arguments": {"layout": "arrow"}
+            }
+        }
+        print("\nSending basic_query (layout=arrow)...")
+        await send_rpc_message(server_input, arrow_query_message)
+        arrow_query_response = await reader.wait_for("4", TOOL_CALL_TIMEOUT)
+        arrow_query_payload = tool_payload(arrow_query_response)
+        if "arrow_b64" in arrow_query_payload:
+            try:
+                print(f"Arrow Table:\n{decode_arrow(arrow_query_payload)}")
+            except ImportError:
+                print(f"Arrow result with {arrow_query_payload['row_count_returned']} row(s); install pyarrow to decode it")
+        else:
+            print(f"Arrow Query Response: {arrow_query_response}")
+
     finally:
-        print("\nTerminating server process...")
-        server_process.terminate()
-        server_process.wait(timeout=5)
-        stderr_output = server_process.stderr.read().decode('utf-8')
-        if stderr_output:
-            print(f"Server Stderr:\n{stderr_output}")
+        if server_process is None:
+            # Leave the shared server running; just hang up
+            server_input.close()
+            await server_input.wait_closed()
+        else:
+            print("\nTerminating server process...")
+            if server_process.returncode is None:
+                server_process.terminate()
+            await asyncio.wait_for(server_process.wait(), 5)
+            await asyncio.wait_for(stderr_task, 5)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    asyncio.run(main())
\ No newline at end of file
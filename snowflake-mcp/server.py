@@ -1,9 +1,22 @@
+import argparse
+import atexit
+import base64
 import os
+import signal
+import sys
+import threading
 import traceback
-from typing import Any, Dict, Optional, Tuple
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Optional, Tuple, get_args
 
+import anyio
+import anyio.lowlevel
+import mcp.types as types
 import snowflake.connector
+from anyio.streams.buffered import BufferedByteReceiveStream
+from anyio.streams.file import FileReadStream
 from mcp.server.fastmcp import FastMCP
+from mcp.shared.message import SessionMessage
 
 mcp = FastMCP("Snowflake (preconfigured queries, SSO-only)", json_response=True)
 
@@ -26,6 +39,60 @@ SELECT
 """,
 }
 
+# QUERIES never changes at runtime, so the listing is built once.
+_ALLOWED: Tuple[str, ...] = tuple(sorted(QUERIES.keys()))
+_LIST_RESPONSE = {
+    "queries": list(_ALLOWED),
+    "params_schema": {
+        "month": "int (required, 1..12)",
+        "year": "int (required, 2000..2100)",
+        "connector_ilike": "string (optional, e.g. 'salesforce' or '%sales%')",
+    },
+}
+
+# Per-query parameter validation: maps query_id -> callable that checks the
+# caller's params and returns the qmark binds for that query. Queries without
+# an entry take no parameters.
+VALIDATORS: Dict[str, Callable[[Dict[str, Any]], Optional[tuple]]] = {}
+
+def _no_binds(params: Dict[str, Any]) -> None:
+    return None
+
+# Queries whose result only depends on the session (CURRENT_USER() etc.). This
+# server never issues USE statements, so the result can't change for the
+# lifetime of a connection and is only fetched once per connection.
+SESSION_STATIC_QUERIES = frozenset({"basic_query"})
+
+# Serializes the first run of a session-static query. Separate from
+# _conn_lock, which is taken inside while checking out a cursor.
+_session_results_lock = threading.Lock()
+
+# Result layouts run_saved_query can return:
+# - rows:    "rows" is a list of row tuples (original format)
+# - columns: "columns_data" maps each column name to its list of values
+# - arrow:   "arrow_b64" is the result as a base64 Arrow IPC stream (needs
+#            pyarrow on both ends)
+# For regular queries, columns/arrow are built from the driver's Arrow
+# batches without per-row tuples. SESSION_STATIC_QUERIES are answered from
+# rows cached on the connection, so those layouts are built from the cached
+# Python tuples instead.
+# Tool signatures use Layout so the tool schema lists the choices.
+Layout = Literal["rows", "columns", "arrow"]
+LAYOUTS: Tuple[str, ...] = get_args(Layout)
+
+# One long-lived connection per server process. Every new connection means
+# another SSO browser round trip, so it's opened lazily and reused.
+_conn_lock = threading.Lock()
+_conn = None
+
+# Idle cursors per query_id, reused for as long as _conn lives. A call takes
+# one out (or opens a new one) and hands it back when done, so concurrent
+# calls never share a cursor.
+_cursors: Dict[str, List[Any]] = {}
+
+# Column names per query_id. The SQL is fixed, so they never change once seen.
+_COLS_CACHE: Dict[str, Tuple[str, ...]] = {}
+
 # -----------------------------
 # Helpers
 # -----------------------------
@@ -65,17 +132,138 @@ def _connect():
 
     return snowflake.connector.connect(**conn_kwargs)
 
-def _normalize_ilike(pattern: Optional[Any]) -> Optional[str]:
-    if pattern is None:
-        return None
-    p = str(pattern).strip()
-    if not p:
-        return None
-    # If caller gives "salesforce", we turn it into "%salesforce%"
-    if "%" not in p:
-        p = f"%{p}%"
-    return p
+def _get_conn():
+    """Return the shared connection, (re)connecting if it's missing or closed."""
+    global _conn
+    with _conn_lock:
+        if _conn is None or _conn.is_closed():
+            _cursors.clear()
+            _conn = _connect()
+        return _conn
 
+# Both run under _conn_lock so a reconnect in _get_conn() (which clears
+# _cursors) can't interleave with taking or handing back a cursor.
+def _checkout_cursor(conn, query_id: str):
+    """Take an idle cursor for query_id, or open a new one on conn."""
+    with _conn_lock:
+        idle = _cursors.get(query_id)
+        if idle and idle[-1].connection is conn:
+            return idle.pop()
+    return conn.cursor()
+
+def _return_cursor(query_id: str, cur) -> None:
+    with _conn_lock:
+        # Cursors from a connection that has since been replaced are dropped
+        if cur.connection is _conn:
+            _cursors.setdefault(query_id, []).append(cur)
+
+def _close_conn() -> None:
+    with _conn_lock:
+        if _conn is not None and not _conn.is_closed():
+            _conn.close()
+
+atexit.register(_close_conn)
+
+def _columns_for(query_id: str, cur) -> Tuple[str, ...]:
+    """Column names of query_id's result; read from cur.description only the first time."""
+    cols = _COLS_CACHE.get(query_id)
+    if cols is None:
+        if not cur.description:
+            return ()
+        cols = _COLS_CACHE[query_id] = tuple(c[0] for c in cur.description)
+    return cols
+
+def _session_static_result(conn, query_id: str, sql: str, binds) -> Tuple[Tuple[str, ...], list]:
+    """
+    Columns and all rows of a session-static query, run at most once per connection.
+
+    The result is stored on the connection itself, so it goes away with it
+    when _get_conn() reconnects. Concurrent first calls wait on
+    _session_results_lock for the one that runs the query.
+    """
+    cache = getattr(conn, "_pm_session_results", None)
+    if cache is not None and query_id in cache:
+        return cache[query_id]
+    with _session_results_lock:
+        cache = getattr(conn, "_pm_session_results", None)
+        if cache is None:
+            cache = conn._pm_session_results = {}
+        if query_id not in cache:
+            cur = _checkout_cursor(conn, query_id)
+            try:
+                cur.execute(sql, binds)
+                cache[query_id] = (_columns_for(query_id, cur), cur.fetchall())
+            finally:
+                _return_cursor(query_id, cur)
+        return cache[query_id]
+
+def _fetch_columns(cur, cols: Tuple[str, ...], max_rows: int) -> Tuple[Dict[str, list], int]:
+    """
+    Fetch up to max_rows via Arrow batches and return them column-wise.
+
+    Values go from each Arrow column into one list per column, so no
+    per-row tuples are built on the way.
+    """
+    data: Dict[str, list] = {name: [] for name in cols}
+    remaining = max_rows
+    for batch in cur.fetch_arrow_batches():
+        if remaining <= 0:
+            break
+        batch = batch.slice(0, remaining)
+        for name, column in zip(cols, batch.columns):
+            data[name].extend(column.to_pylist())
+        remaining -= batch.num_rows
+    return data, max_rows - remaining
+
+def _fetch_arrow(cur, cols: Tuple[str, ...], max_rows: int):
+    """
+    Fetch up to max_rows via Arrow batches into a single pyarrow.Table.
+
+    pyarrow is imported on first use here and in the other Arrow helpers:
+    only layout="arrow" needs it, and it's a heavy import for every other
+    call (it ships with snowflake-connector-python[pandas]).
+    """
+    import pyarrow as pa
+
+    batches = []
+    remaining = max_rows
+    for batch in cur.fetch_arrow_batches():
+        if remaining <= 0:
+            break
+        batch = batch.slice(0, remaining)
+        batches.append(batch)
+        remaining -= batch.num_rows
+    if not batches:
+        # No result chunks to take a schema from
+        return pa.Table.from_arrays([pa.array([]) for _ in cols], names=list(cols))
+    return pa.concat_tables(batches)
+
+def _rows_to_arrow(cols: Tuple[str, ...], rows: list):
+    import pyarrow as pa
+
+    return pa.Table.from_arrays(
+        [pa.array([row[i] for row in rows]) for i in range(len(cols))],
+        names=list(cols),
+    )
+
+def _arrow_b64(table) -> str:
+    """Serialize table as an Arrow IPC stream, base64-encoded for the JSON response."""
+    import pyarrow as pa
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return base64.b64encode(sink.getvalue().to_pybytes()).decode("ascii")
+
+def _traceback_tail(exc: BaseException, lines: int = 20) -> List[str]:
+    """
+    Last `lines` lines of exc's formatted traceback.
+
+    A negative limit keeps only the innermost frames while the stack is
+    walked, so deep driver stacks are never formatted in full.
+    """
+    tb = traceback.format_exception(type(exc), exc, exc.__traceback__, limit=-lines)
+    return "".join(tb).splitlines()[-lines:]
 
 # -----------------------------
 # MCP tools
@@ -83,61 +271,294 @@ def _normalize_ilike(pattern: Optional[Any]) -> Optional[str]:
 @mcp.tool()
 def list_saved_queries() -> dict:
     """List IDs of allowed, pre-configured queries."""
-    return {
-        "queries": sorted(QUERIES.keys()),
-        "params_schema": {
-            "month": "int (required, 1..12)",
-            "year": "int (required, 2000..2100)",
-            "connector_ilike": "string (optional, e.g. 'salesforce' or '%sales%')",
-        },
-    }
-
-def _params_for(query_id: str, params: Optional[Dict[str, Any]]) -> Optional[list]:
-    """
-    Returns the binds for a given query_id and params.
-    """
-    return None
-
+    return _LIST_RESPONSE
 
 @mcp.tool()
-def run_saved_query(
+async def run_saved_query(
     query_id: str,
     params: Optional[Dict[str, Any]] = None,
-    max_rows: int = 500
+    max_rows: int = 500,
+    layout: Layout = "rows"
 ) -> dict:
     """
     Run a pre-configured query by ID (NO raw SQL).
+
+    layout="rows" returns a list of rows; layout="columns" returns one list
+    of values per column under "columns_data"; layout="arrow" returns the
+    result as a base64 Arrow IPC stream under "arrow_b64".
     """
     if query_id not in QUERIES:
-        return {"ok": False, "error": f"Unknown query_id '{query_id}'", "allowed": sorted(QUERIES.keys())}
+        return {"ok": False, "error": f"Unknown query_id '{query_id}'", "allowed": _ALLOWED}
+    # The driver call blocks; run it in a worker thread so the event loop keeps
+    # serving other requests meanwhile.
+    return await anyio.to_thread.run_sync(
+        _run_query, query_id, QUERIES[query_id], params, max_rows, layout
+    )
+
+def _run_query(
+    query_id: str,
+    sql: str,
+    params: Optional[Dict[str, Any]],
+    max_rows: int,
+    layout: str
+) -> dict:
+    if layout not in LAYOUTS:
+        return {"ok": False, "error": f"Unknown layout '{layout}'", "allowed_layouts": list(LAYOUTS)}
 
-    sql = QUERIES[query_id]
     max_rows = max(1, min(int(max_rows), 5000))
 
     try:
-        binds = None
-        with _connect() as conn:
-            with conn.cursor() as cur:
+        binds = VALIDATORS.get(query_id, _no_binds)(params or {})
+        conn = _get_conn()
+        if query_id in SESSION_STATIC_QUERIES:
+            cols, rows = _session_static_result(conn, query_id, sql, binds)
+            rows = rows[:max_rows]
+            row_count = len(rows)
+            if layout == "columns":
+                data = {"columns_data": {name: [row[i] for row in rows] for i, name in enumerate(cols)}}
+            elif layout == "arrow":
+                data = {"arrow_b64": _arrow_b64(_rows_to_arrow(cols, rows))}
+            else:
+                data = {"rows": rows}
+        else:
+            cur = _checkout_cursor(conn, query_id)
+            try:
                 cur.execute(sql, binds)
-                cols = [c[0] for c in cur.description] if cur.description else []
-                rows = cur.fetchmany(max_rows)
-                return {
-                    "ok": True,
-                    "query_id": query_id,
-                    "params_used": params or {},
-                    "columns": cols,
-                    "rows": rows,
-                    "row_count_returned": len(rows),
-                    "row_limit": max_rows,
-                }
+                cols = _columns_for(query_id, cur)
+                if layout == "columns":
+                    columns_data, row_count = _fetch_columns(cur, cols, max_rows)
+                    data = {"columns_data": columns_data}
+                elif layout == "arrow":
+                    table = _fetch_arrow(cur, cols, max_rows)
+                    row_count = table.num_rows
+                    data = {"arrow_b64": _arrow_b64(table)}
+                else:
+                    rows = cur.fetchmany(max_rows)
+                    row_count = len(rows)
+                    data = {"rows": rows}
+            finally:
+                _return_cursor(query_id, cur)
+        return {
+            "ok": True,
+            "query_id": query_id,
+            "params_used": params or {},
+            "layout": layout,
+            "columns": cols,
+            **data,
+            "row_count_returned": row_count,
+            "row_limit": max_rows,
+        }
     except Exception as e:
         return {
             "ok": False,
             "query_id": query_id,
             "error_type": type(e).__name__,
             "error": str(e),
-            "traceback_tail": traceback.format_exc().splitlines()[-20:],
+            "traceback_tail": _traceback_tail(e),
         }
 
+def _register_query_tool(query_id: str, sql: str) -> None:
+    """
+    Register a dedicated tool for one parameterless saved query.
+
+    The SQL is bound in the closure, so a call skips the query_id lookup
+    and params handling that run_saved_query does.
+    """
+    async def query_tool(max_rows: int = 500, layout: Layout = "rows") -> dict:
+        return await anyio.to_thread.run_sync(_run_query, query_id, sql, None, max_rows, layout)
+
+    mcp.tool(
+        name=query_id,
+        description=f"Run the pre-configured '{query_id}' query (same result format as run_saved_query).",
+    )(query_tool)
+
+for _query_id, _sql in QUERIES.items():
+    if _query_id not in VALIDATORS:
+        _register_query_tool(_query_id, _sql)
+
+# -----------------------------
+# Content-Length framed transport
+# -----------------------------
+# Opt-in alternative to FastMCP's newline-delimited stdio transport: each
+# message is sent as "Content-Length: N\r\n\r\n" + N bytes of JSON (LSP style),
+# so the peer reads a body in one fixed-size read instead of scanning it for
+# a newline. Gemini CLI speaks plain stdio, so that stays the default.
+MAX_HEADER_BYTES = 4096
+
+def _content_length(header: bytes) -> int:
+    for line in header.split(b"\r\n"):
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+            if length < 0:
+                raise ValueError(f"Negative Content-Length in header: {header!r}")
+            return length
+    raise ValueError(f"Missing Content-Length in header: {header!r}")
+
+def _frame_header(length: int) -> bytes:
+    return b"Content-Length: %d\r\n\r\n" % length
+
+def _write_all(fd: int, buffers: List[bytes]) -> None:
+    """
+    Write buffers to fd back to back, in a single writev() call where possible.
+
+    A pipe can accept a large write in pieces (e.g. when interrupted), so
+    whatever writev() didn't take is finished with plain write() calls,
+    slicing the buffers in place rather than joining them.
+    """
+    written = os.writev(fd, buffers) if hasattr(os, "writev") else 0
+    for buf in buffers:
+        if written >= len(buf):
+            written -= len(buf)
+            continue
+        rest = memoryview(buf)[written:]
+        written = 0
+        while rest:
+            rest = rest[os.write(fd, rest):]
+
+@asynccontextmanager
+async def _framed_streams(
+    receive: BufferedByteReceiveStream,
+    send: Callable[[List[bytes]], Awaitable[None]],
+):
+    """
+    Adapt a Content-Length framed byte stream to the (read, write) memory
+    streams the low-level MCP server runs on, mirroring mcp.server.stdio.
+    """
+    read_stream_writer, read_stream = anyio.create_memory_object_stream(0)
+    write_stream, write_stream_reader = anyio.create_memory_object_stream(0)
+
+    async def reader():
+        try:
+            async with read_stream_writer:
+                while True:
+                    try:
+                        header = await receive.receive_until(b"\r\n\r\n", MAX_HEADER_BYTES)
+                        body = await receive.receive_exactly(_content_length(header))
+                    except anyio.IncompleteRead:
+                        # Peer closed the stream
+                        break
+                    except (ValueError, anyio.DelimiterNotFound) as exc:
+                        # Bad or oversized header: the stream can't be re-synced,
+                        # so end this session instead of crashing the server
+                        print(f"Closing session on malformed frame: {exc}", file=sys.stderr)
+                        break
+                    try:
+                        message = types.JSONRPCMessage.model_validate_json(body)
+                    except Exception as exc:
+                        await read_stream_writer.send(exc)
+                        continue
+                    await read_stream_writer.send(SessionMessage(message))
+        except anyio.ClosedResourceError:
+            await anyio.lowlevel.checkpoint()
+
+    async def writer():
+        try:
+            async with write_stream_reader:
+                async for session_message in write_stream_reader:
+                    body = session_message.message.model_dump_json(by_alias=True, exclude_none=True)
+                    data = body.encode("utf-8")
+                    await send([_frame_header(len(data)), data])
+        except anyio.ClosedResourceError:
+            await anyio.lowlevel.checkpoint()
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(reader)
+        tg.start_soon(writer)
+        yield read_stream, write_stream
+
+async def _serve(read_stream, write_stream) -> None:
+    # FastMCP has no public hook for custom transports; this is what its own
+    # run_stdio_async() does with the streams it builds.
+    server = mcp._mcp_server
+    await server.run(read_stream, write_stream, server.create_initialization_options())
+
+async def _run_framed_stdio() -> None:
+    # Unbuffered stdin so each receive() returns whatever the pipe has,
+    # instead of blocking until a full buffer's worth arrives.
+    stdin = BufferedByteReceiveStream(
+        FileReadStream(open(sys.stdin.fileno(), "rb", buffering=0, closefd=False))
+    )
+    stdout_fd = sys.stdout.fileno()
+
+    async def send(buffers: List[bytes]) -> None:
+        await anyio.to_thread.run_sync(_write_all, stdout_fd, buffers)
+
+    async with _framed_streams(stdin, send) as (read_stream, write_stream):
+        await _serve(read_stream, write_stream)
+
+async def _handle_connection(stream) -> None:
+    """Serve one MCP session (initialize included) over an accepted socket."""
+    async def send(buffers: List[bytes]) -> None:
+        # Sent one by one: joining would copy the whole body just to prepend
+        # a few header bytes
+        for buf in buffers:
+            await stream.send(buf)
+
+    try:
+        async with stream:
+            async with _framed_streams(BufferedByteReceiveStream(stream), send) as (read_stream, write_stream):
+                await _serve(read_stream, write_stream)
+    except Exception:
+        # One client going away badly must not take the listener down
+        traceback.print_exc()
+
+async def _stop_on_sigterm(scope: anyio.CancelScope) -> None:
+    """Cancel scope on SIGTERM so the listener unwinds like it does on Ctrl-C."""
+    with anyio.open_signal_receiver(signal.SIGTERM) as signals:
+        async for _ in signals:
+            print("Received SIGTERM, shutting down", file=sys.stderr)
+            scope.cancel()
+            return
+
+async def _run_unix_listener(path: str) -> None:
+    """
+    Long-running mode: accept Content-Length framed sessions on a unix socket.
+
+    Each connection gets its own MCP session, while the interpreter, the
+    imported driver and the cached Snowflake connection are shared, so
+    clients only pay for the query itself.
+    """
+    try:
+        probe = await anyio.connect_unix(path)
+    except OSError:
+        # Nothing there, or a stale socket from a previous run (which
+        # create_unix_listener replaces; it never removes non-socket files)
+        pass
+    else:
+        await probe.aclose()
+        raise SystemExit(f"Another server is already listening on {path}")
+    # Socket is owner-only: anyone who can connect runs queries as this SSO user
+    listener = await anyio.create_unix_listener(path, mode=0o600)
+    print(f"Listening on {path}", file=sys.stderr)
+    try:
+        async with anyio.create_task_group() as tg:
+            tg.start_soon(_stop_on_sigterm, tg.cancel_scope)
+            await listener.serve(_handle_connection, task_group=tg)
+    finally:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
 if __name__ == "__main__":
-    mcp.run(transport="stdio")
+    parser = argparse.ArgumentParser(description=mcp.name)
+    parser.add_argument(
+        "--framing",
+        choices=("newline", "content-length"),
+        default="newline",
+        help="stdio message framing (default: newline-delimited JSON, as MCP clients expect)",
+    )
+    parser.add_argument(
+        "--listen",
+        metavar="PATH",
+        help="serve Content-Length framed sessions on this unix socket instead of stdio",
+    )
+    args = parser.parse_args()
+
+    if args.listen:
+        anyio.run(_run_unix_listener, args.listen)
+    elif args.framing == "content-length":
+        anyio.run(_run_framed_stdio)
+    else:
+        mcp.run(transport="stdio")